@@ -1,11 +1,13 @@
+import itertools
 import logging
 import threading
 import queue
 import os
+import sys
 import time
 import datetime
 
-from typing import Any, Dict, List, Optional, Set, Tuple, TypeVar, cast
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, TypeVar, Union
 
 from parsl.log_utils import set_file_logger
 from parsl.dataflow.states import States
@@ -22,9 +24,8 @@ X = TypeVar('X')
 try:
     import sqlalchemy as sa
     from sqlalchemy import Column, Text, Float, Boolean, BigInteger, Integer, DateTime, PrimaryKeyConstraint, Table
-    from sqlalchemy.orm import Mapper
-    from sqlalchemy.orm import mapperlib
-    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
     from sqlalchemy.orm import declarative_base
 except ImportError:
     _sqlalchemy_enabled = False
@@ -40,6 +41,35 @@ RESOURCE = 'resource'    # Resource table includes task resource utilization
 NODE = 'node'            # Node table include node info
 BLOCK = 'block'          # Block table include the status for block polling
 
+# Rows per conn.execute() call in Database.bulk_apply. Paging the
+# executemany keeps the number of row dicts materialized at any one time
+# bounded, whatever the batch size.
+EXECUTEMANY_PAGE_SIZE = 1000
+
+# Bounds for the adaptive batching threshold: how fast a batch commits
+# varies enormously between (for example) SQLite on a parallel
+# filesystem and a local PostgreSQL, so the threshold is adjusted at
+# runtime between these limits based on observed commit latency.
+MIN_BATCHING_THRESHOLD = 100
+MAX_BATCHING_THRESHOLD = 10000
+
+# A single operation for Database.bulk_apply: (op, table, columns, messages),
+# where op is 'insert', 'update' or 'upsert', columns is the column subset
+# used for updates (None for inserts; the conflict-update subset for
+# upserts) and messages are the raw monitoring messages that will be
+# projected into database rows.
+DBOp = Tuple[str, str, Optional[List[str]], List[MonitoringMessage]]
+
+# The columns of the task table which a TASK_INFO message may change
+# after the row has first been inserted.
+TASK_UPDATE_COLUMNS = ['task_time_invoked',
+                       'task_time_returned',
+                       'run_id', 'task_id',
+                       'task_fail_count',
+                       'task_fail_cost',
+                       'task_hashsum',
+                       'task_inputs']
+
 
 class Database:
 
@@ -53,7 +83,43 @@ class Database:
                  url: str = 'sqlite:///runinfomonitoring.db',
                  ):
 
-        self.eng = sa.create_engine(url)
+        # Driver-specific executemany fast paths are off by default:
+        # psycopg2's "fast execution helpers" and pyodbc's
+        # fast_executemany each make batched DML many times faster than
+        # the drivers' one-row-at-a-time default. The db_url is
+        # user-supplied, so the driver is detected from the URL; other
+        # drivers get a plain engine.
+        url_obj = sa.engine.make_url(url)
+        engine_kwargs = {}  # type: Dict[str, Any]
+        if url_obj.get_backend_name() == 'postgresql' and url_obj.get_driver_name() == 'psycopg2':
+            engine_kwargs['executemany_mode'] = 'values_plus_batch'
+        elif url_obj.get_backend_name() == 'mssql' and url_obj.get_driver_name() == 'pyodbc':
+            engine_kwargs['fast_executemany'] = True
+
+        self.eng = sa.create_engine(url, **engine_kwargs)
+
+        # The monitoring workload is write-dominant: the manager commits
+        # batches of inserts and updates far more often than anything reads
+        # the database. With SQLite's default DELETE journal mode, every one
+        # of those commits takes an exclusive lock and pays a full fsync,
+        # blocking any concurrent reader (for example, parsl-visualize
+        # pointed at the database of a live workflow). WAL mode with
+        # synchronous=NORMAL allows readers to proceed while a commit is in
+        # flight and substantially reduces fsync cost. These PRAGMAs are
+        # per-connection, so they are issued from a connect-time event
+        # handler rather than once at engine creation. Non-SQLite databases
+        # are unaffected.
+        if url.startswith("sqlite") and ":memory:" not in url:
+            @sa.event.listens_for(self.eng, "connect")  # type: ignore[misc]
+            def set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+                cursor.execute("PRAGMA temp_store=MEMORY")
+                cursor.execute("PRAGMA cache_size=-65536")
+                cursor.execute("PRAGMA wal_autocheckpoint=1000")
+                cursor.close()
+
         self.meta = self.Base.metadata
 
         # TODO: this code wants a read lock on the sqlite3 database, and fails if it cannot
@@ -64,55 +130,147 @@ class Database:
 
         self.meta.reflect(bind=self.eng)
 
-        Session = sessionmaker(bind=self.eng)
-        self.session = Session()
-
-    def _get_mapper(self, table_obj: Table) -> Mapper:
-        all_mappers: Set[Mapper] = set()
-        for mapper_registry in mapperlib._all_registries():  # type: ignore[attr-defined]
-            all_mappers.update(mapper_registry.mappers)
-        mapper_gen = (
-            mapper for mapper in all_mappers
-            if table_obj in mapper.tables
-        )
-        try:
-            mapper = next(mapper_gen)
-            second_mapper = next(mapper_gen, False)
-        except StopIteration:
-            raise ValueError(f"Could not get mapper for table {table_obj}")
-
-        if second_mapper:
-            raise ValueError(f"Multiple mappers for table {table_obj}")
-        return mapper
-
-    def update(self, *, table: str, columns: List[str], messages: List[MonitoringMessage]) -> None:
+        # The column names of each table, resolved once. sys.intern makes
+        # the keys of every generated row mapping the same string objects
+        # for the life of the manager, so the dict construction in
+        # _generate_mappings and SQLAlchemy's parameter processing hit
+        # the identity-comparison fast path instead of hashing and
+        # comparing fresh strings for millions of rows.
+        # str() first: after reflection the keys are quoted_name (a str
+        # subclass), and sys.intern only accepts exact str instances.
+        self._columns_by_table = {}  # type: Dict[str, Tuple[str, ...]]
+        for name, table_obj in self.meta.tables.items():
+            self._columns_by_table[name] = tuple(sys.intern(str(c)) for c in table_obj.c.keys())
+
+        # Statement constructs are built once per (table, columns) shape
+        # and reused: the manager issues the same handful of statements
+        # once a second for the lifetime of a workflow, so there is no
+        # point re-deriving them per batch. Reusing the same construct
+        # also lets SQLAlchemy's compiled-statement cache take effect.
+        self._insert_stmts = {}  # type: Dict[str, Any]
+        self._update_stmts = {}  # type: Dict[Tuple[str, Tuple[str, ...]], Tuple[Any, Tuple[str, ...]]]
+        self._upsert_stmts = {}  # type: Dict[Tuple[str, Tuple[str, ...]], Any]
+
+        # SQLite (>= 3.24) and PostgreSQL both support
+        # INSERT ... ON CONFLICT DO UPDATE, which lets an insert and an
+        # update against the same table collapse into one statement.
+        # Other dialects fall back to separate INSERT and UPDATE paths.
+        self.supports_upsert = self.eng.dialect.name in ('sqlite', 'postgresql')
+
+    def bulk_apply(self, ops: List[DBOp]) -> None:
+        """Apply a list of insert/update operations inside one transaction.
+
+        The database manager issues several inserts and updates per batch
+        of messages; executing them under a single BEGIN/COMMIT means one
+        fsync (on SQLite) or one commit round-trip (on networked
+        databases) per batch instead of one per operation, and makes the
+        whole batch atomic so a retried batch cannot be half-applied.
+        """
+        with self.eng.begin() as conn:
+            for op, table, columns, messages in ops:
+                if op == 'insert':
+                    stmt, params = self._prepare_insert(table, messages)
+                elif op == 'update':
+                    assert columns is not None
+                    stmt, params = self._prepare_update(table, columns, messages)
+                elif op == 'upsert':
+                    assert columns is not None
+                    stmt, params = self._prepare_upsert(table, columns, messages)
+                else:
+                    raise ValueError("Unknown database operation {}".format(op))
+
+                # The parameter mappings are generated lazily, so consume
+                # them a page at a time: SQLAlchemy 1.4 needs a concrete
+                # sequence for executemany, and paging bounds how many row
+                # dicts exist at once however large the message batch is.
+                params_iter = iter(params)
+                while True:
+                    page = list(itertools.islice(params_iter, EXECUTEMANY_PAGE_SIZE))
+                    if page == []:
+                        break
+                    conn.execute(stmt, page)
+
+    def _prepare_update(self, table: str, columns: List[str], messages: List[MonitoringMessage]) -> Tuple[Any, Iterator[Dict[str, Any]]]:
         table_obj = self.meta.tables[table]
+
+        # Ignore names which are not columns of the table: callers pass
+        # derived message keys (for example workflow_duration on the
+        # abnormal-exit workflow update) which the ORM bulk update API
+        # used to discard silently, but which a Core UPDATE would reject
+        # at compile time as unconsumed.
+        columns = [c for c in columns if c in table_obj.c]
         mappings = self._generate_mappings(table_obj, columns=columns,
                                            messages=messages)
-        mapper = self._get_mapper(table_obj)
-        self.session.bulk_update_mappings(mapper, mappings)
-        self.session.commit()
 
-    def insert(self, *, table: str, messages: List[MonitoringMessage]) -> None:
+        # Build an UPDATE keyed on the primary key columns, in the style of
+        # the (legacy) ORM bulk_update_mappings API this replaces: each
+        # mapping must contain every primary key column, and the remaining
+        # columns become the SET clause. Executing one statement with a list
+        # of parameter dicts lets the DBAPI use its executemany fast path
+        # rather than doing per-row unit-of-work bookkeeping in the ORM.
+        key = (table, tuple(columns))
+        cached = self._update_stmts.get(key)
+        if cached is None:
+            pk_names = tuple(c.name for c in table_obj.primary_key.columns)
+            value_names = [c for c in columns if c not in pk_names]
+            stmt = table_obj.update()
+            for name in pk_names:
+                stmt = stmt.where(table_obj.c[name] == sa.bindparam("_pk_" + name))
+            stmt = stmt.values({name: sa.bindparam("_v_" + name) for name in value_names})
+            cached = (stmt, pk_names)
+            self._update_stmts[key] = cached
+        stmt, pk_names = cached
+
+        params = ({("_pk_" if k in pk_names else "_v_") + k: v for k, v in m.items()}
+                  for m in mappings)
+
+        return stmt, params
+
+    def _prepare_insert(self, table: str, messages: List[MonitoringMessage]) -> Tuple[Any, Iterator[Dict[str, Any]]]:
+        table_obj = self.meta.tables[table]
+        mappings = self._generate_mappings(table_obj, messages=messages)
+        stmt = self._insert_stmts.get(table)
+        if stmt is None:
+            stmt = table_obj.insert()
+            self._insert_stmts[table] = stmt
+        return stmt, mappings
+
+    def _prepare_upsert(self, table: str, columns: List[str], messages: List[MonitoringMessage]) -> Tuple[Any, Iterator[Dict[str, Any]]]:
+        """Prepare an INSERT ... ON CONFLICT DO UPDATE statement.
+
+        Rows whose primary key is not yet present are inserted in full;
+        rows that conflict on the primary key have the named (non-primary
+        key) columns updated from the incoming row, matching what a
+        separate UPDATE with that column subset would have done.
+        """
         table_obj = self.meta.tables[table]
         mappings = self._generate_mappings(table_obj, messages=messages)
-        mapper = self._get_mapper(table_obj)
-        self.session.bulk_insert_mappings(mapper, mappings)
-        self.session.commit()
-
-    def rollback(self) -> None:
-        self.session.rollback()
-
-    def _generate_mappings(self, table: Table, columns: Optional[List[str]] = None, messages: List[MonitoringMessage] = []) -> List[Dict[str, Any]]:
-        mappings = []
-        for msg in messages:
-            m = {}
-            if columns is None:
-                columns = table.c.keys()
-            for column in columns:
-                m[column] = msg.get(column, None)
-            mappings.append(m)
-        return mappings
+
+        key = (table, tuple(columns))
+        stmt = self._upsert_stmts.get(key)
+        if stmt is None:
+            if self.eng.dialect.name == 'sqlite':
+                stmt = sqlite_insert(table_obj)
+            elif self.eng.dialect.name == 'postgresql':
+                stmt = postgresql_insert(table_obj)
+            else:
+                raise ValueError("Dialect {} does not support upsert".format(self.eng.dialect.name))
+
+            pk_names = [c.name for c in table_obj.primary_key.columns]
+            set_ = {name: stmt.excluded[name] for name in columns if name not in pk_names}
+            stmt = stmt.on_conflict_do_update(index_elements=pk_names, set_=set_)
+            self._upsert_stmts[key] = stmt
+        return stmt, mappings
+
+    def _generate_mappings(self, table: Table, columns: Optional[List[str]] = None,
+                           messages: List[MonitoringMessage] = []) -> Iterator[Dict[str, Any]]:
+        # The column names come from the interned per-table tuples built
+        # at construction time rather than being re-derived per batch.
+        # The mappings themselves are generated lazily so that bulk_apply
+        # can page through them without the whole batch of row dicts being
+        # resident at once.
+        cols = tuple(columns) if columns is not None else self._columns_by_table[table.name]
+        return ({c: msg.get(c, None) for c in cols} for msg in messages)
 
     class Workflow(Base):
         __tablename__ = WORKFLOW
@@ -134,8 +292,12 @@ class Database:
         timestamp = Column(DateTime, nullable=False)
         run_id = Column(Text, sa.ForeignKey('workflow.run_id'), nullable=False)
         try_id = Column('try_id', Integer, nullable=False)
+        # run_id leads the primary key so that the underlying index also
+        # serves run-scoped and (run_id, task_id)-scoped queries, which is
+        # how both the manager's updates and the visualization tool read
+        # this table.
         __table_args__ = (
-            PrimaryKeyConstraint('task_id', 'run_id',
+            PrimaryKeyConstraint('run_id', 'task_id',
                                  'task_status_name', 'timestamp'),
         )
 
@@ -240,14 +402,18 @@ class Database:
             'psutil_process_time_user', Float, nullable=True)
         psutil_process_time_system = Column(
             'psutil_process_time_system', Float, nullable=True)
+        # byte counts, which psutil reports as integers: storing them as
+        # BigInteger rather than Float keeps full precision for values
+        # beyond 2**53 and stores far more compactly than text or float
+        # representations on most backends
         psutil_process_memory_virtual = Column(
-            'psutil_process_memory_virtual', Float, nullable=True)
+            'psutil_process_memory_virtual', BigInteger, nullable=True)
         psutil_process_memory_resident = Column(
-            'psutil_process_memory_resident', Float, nullable=True)
+            'psutil_process_memory_resident', BigInteger, nullable=True)
         psutil_process_disk_read = Column(
-            'psutil_process_disk_read', Float, nullable=True)
+            'psutil_process_disk_read', BigInteger, nullable=True)
         psutil_process_disk_write = Column(
-            'psutil_process_disk_write', Float, nullable=True)
+            'psutil_process_disk_write', BigInteger, nullable=True)
         psutil_process_status = Column(
             'psutil_process_status', Text, nullable=True)
         psutil_cpu_num = Column(
@@ -258,6 +424,10 @@ class Database:
             'psutil_process_num_ctx_switches_involuntary', Float, nullable=True)
         __table_args__ = (
             PrimaryKeyConstraint('try_id', 'task_id', 'run_id', 'timestamp'),
+            # the primary key is ordered by try before task and run, so
+            # give run-scoped per-task timeseries queries an index they
+            # can use without scanning the whole (large) table
+            sa.Index('ix_resource_run_task_ts', 'run_id', 'task_id', 'timestamp'),
         )
 
 
@@ -267,7 +437,7 @@ class DatabaseManager:
                  logdir: str = '.',
                  logging_level: int = logging.INFO,
                  batching_interval: float = 1,
-                 batching_threshold: float = 99999,
+                 batching_threshold: float = 10000,
                  ):
 
         self.workflow_end = False
@@ -287,49 +457,39 @@ class DatabaseManager:
         self.batching_interval = batching_interval
         self.batching_threshold = batching_threshold
 
-        self.pending_priority_queue = queue.Queue()  # type: queue.Queue[TaggedMonitoringMessage]
-        self.pending_node_queue = queue.Queue()  # type: queue.Queue[MonitoringMessage]
-        self.pending_block_queue = queue.Queue()  # type: queue.Queue[MonitoringMessage]
-        self.pending_resource_queue = queue.Queue()  # type: queue.Queue[MonitoringMessage]
-
     def start(self,
-              priority_queue: "queue.Queue[TaggedMonitoringMessage]",
-              node_queue: "queue.Queue[MonitoringMessage]",
-              block_queue: "queue.Queue[MonitoringMessage]",
-              resource_queue: "queue.Queue[MonitoringMessage]") -> None:
+              priority_queue: "queue.Queue[Union[TaggedMonitoringMessage, str]]",
+              node_queue: "queue.Queue[TaggedMonitoringMessage]",
+              block_queue: "queue.Queue[TaggedMonitoringMessage]",
+              resource_queue: "queue.Queue[TaggedMonitoringMessage]") -> None:
 
         self._kill_event = threading.Event()
-        self._priority_queue_pull_thread = threading.Thread(target=self._migrate_logs_to_internal,
-                                                            args=(
-                                                                priority_queue, 'priority', self._kill_event,),
-                                                            name="Monitoring-migrate-priority",
-                                                            daemon=True,
-                                                            )
-        self._priority_queue_pull_thread.start()
-
-        self._node_queue_pull_thread = threading.Thread(target=self._migrate_logs_to_internal,
-                                                        args=(
-                                                            node_queue, 'node', self._kill_event,),
-                                                        name="Monitoring-migrate-node",
-                                                        daemon=True,
-                                                        )
-        self._node_queue_pull_thread.start()
-
-        self._block_queue_pull_thread = threading.Thread(target=self._migrate_logs_to_internal,
-                                                         args=(
-                                                             block_queue, 'block', self._kill_event,),
-                                                         name="Monitoring-migrate-block",
-                                                         daemon=True,
-                                                         )
-        self._block_queue_pull_thread.start()
-
-        self._resource_queue_pull_thread = threading.Thread(target=self._migrate_logs_to_internal,
-                                                            args=(
-                                                                resource_queue, 'resource', self._kill_event,),
-                                                            name="Monitoring-migrate-resource",
-                                                            daemon=True,
-                                                            )
-        self._resource_queue_pull_thread.start()
+
+        # Batches of database operations are handed to a dedicated writer
+        # thread, so that draining the queues and preparing the next batch
+        # overlaps with the previous commit's fsync or network round-trip.
+        # The small maxsize bounds memory if the database falls behind and
+        # applies backpressure to the drain loop rather than buffering
+        # without limit.
+        self._write_queue = queue.Queue(maxsize=4)  # type: queue.Queue[Optional[List[DBOp]]]
+        self._writer_thread = threading.Thread(target=self._writer,
+                                               name="Monitoring-DB-Writer",
+                                               daemon=True,
+                                               )
+        self._writer_thread.start()
+
+        # Each of the four source queues used to be drained by its own
+        # pull thread which copied messages, unmodified, onto an internal
+        # pending queue for the main loop to consume. That doubled the
+        # enqueue/dequeue cost of every message and added a thread context
+        # switch for no transformation beyond dropping the sender address.
+        # The main loop now drains the source queues directly and does the
+        # projection and validation at drain time.
+        #
+        # The source queues themselves are multiprocessing queues owned by
+        # the MonitoringHub and shared with the router process, so they
+        # cannot be replaced with cheaper same-process structures such as
+        # queue.SimpleQueue or collections.deque here.
 
         """
         maintain a set to track the tasks that are already INSERTed into database
@@ -339,12 +499,12 @@ class DatabaseManager:
         If that happens, the message will be added to deferred_resource_messages and processed later.
 
         """
-        inserted_tasks = set()  # type: Set[object]
+        inserted_tasks: Set[object] = set()
 
         """
         like inserted_tasks but for task,try tuples
         """
-        inserted_tries = set()  # type: Set[Any]
+        inserted_tries: Set[Any] = set()
 
         # for any task ID, we can defer exactly one message, which is the
         # assumed-to-be-unique first message (with first message flag set).
@@ -354,23 +514,26 @@ class DatabaseManager:
 
         exception_happened = False
 
-        while (not self._kill_event.is_set() or
-               self.pending_priority_queue.qsize() != 0 or self.pending_resource_queue.qsize() != 0 or
-               self.pending_node_queue.qsize() != 0 or self.pending_block_queue.qsize() != 0 or
-               priority_queue.qsize() != 0 or resource_queue.qsize() != 0 or
-               node_queue.qsize() != 0 or block_queue.qsize() != 0):
+        while True:
 
             """
             WORKFLOW_INFO and TASK_INFO messages (i.e. priority messages)
 
             """
+
+            # Tracks whether this pass over the source queues yielded any
+            # messages. The loop used to re-check qsize() on every queue
+            # each iteration to decide whether to stop - each such call
+            # costs a lock acquisition or (for multiprocessing queues) a
+            # shared counter access. Instead, stop once a kill has been
+            # requested and a complete pass drains nothing.
+            got_messages = False
+
             try:
-                logger.debug("""Checking STOP conditions: {}, {}, {}, {}, {}, {}, {}, {}, {}""".format(
-                                  self._kill_event.is_set(),
-                                  self.pending_priority_queue.qsize() != 0, self.pending_resource_queue.qsize() != 0,
-                                  self.pending_node_queue.qsize() != 0, self.pending_block_queue.qsize() != 0,
-                                  priority_queue.qsize() != 0, resource_queue.qsize() != 0,
-                                  node_queue.qsize() != 0, block_queue.qsize() != 0))
+                # The database operations for this batch of messages are
+                # accumulated here, in order, and applied in one transaction
+                # at the end of the iteration.
+                ops = []  # type: List[DBOp]
 
                 # This is the list of resource messages which can be reprocessed as if they
                 # had just arrived because the corresponding first task message has been
@@ -385,10 +548,20 @@ class DatabaseManager:
                 reprocessable_last_resource_messages: List[Any] = []
 
                 # Get a batch of priority messages
-                priority_messages = self._get_messages_in_batch(self.pending_priority_queue)
+                priority_batch = self._get_messages_in_batch(priority_queue)
+                got_messages = got_messages or priority_batch != []
+                priority_messages = []  # type: List[TaggedMonitoringMessage]
+                for x in priority_batch:
+                    if x == 'STOP':
+                        self.close()
+                    else:
+                        assert isinstance(x, tuple)
+                        assert len(x) == 2
+                        assert x[0] in [MessageType.WORKFLOW_INFO, MessageType.TASK_INFO], \
+                            "the priority queue can only hold WORKFLOW_,TASK_INFO messages, got x[0] == {}".format(x[0])
+                        priority_messages.append(x)
                 if priority_messages:
-                    logger.debug(
-                        "Got {} messages from priority queue".format(len(priority_messages)))
+                    logger.debug("Got %s messages from priority queue", len(priority_messages))
                     task_info_update_messages, task_info_insert_messages, task_info_all_messages = [], [], []
                     try_update_messages, try_insert_messages, try_all_messages = [], [], []
                     for msg_type, msg in priority_messages:
@@ -396,15 +569,15 @@ class DatabaseManager:
                             if "python_version" in msg:   # workflow start message
                                 logger.debug(
                                     "Inserting workflow start info to WORKFLOW table")
-                                self._insert(table=WORKFLOW, messages=[msg])
+                                ops.append(('insert', WORKFLOW, None, [msg]))
                                 self.workflow_start_message = msg
                             else:                         # workflow end message
                                 logger.debug(
                                     "Updating workflow end info to WORKFLOW table")
-                                self._update(table=WORKFLOW,
-                                             columns=['run_id', 'tasks_failed_count',
-                                                      'tasks_completed_count', 'time_completed'],
-                                             messages=[msg])
+                                ops.append(('update', WORKFLOW,
+                                            ['run_id', 'tasks_failed_count',
+                                             'tasks_completed_count', 'time_completed'],
+                                            [msg]))
                                 self.workflow_end = True
 
                         elif msg_type == MessageType.TASK_INFO:
@@ -431,86 +604,124 @@ class DatabaseManager:
                             raise RuntimeError("Unexpected message type {} received on priority queue".format(msg_type))
 
                     logger.debug("Updating and inserting TASK_INFO to all tables")
-                    logger.debug("Updating {} TASK_INFO into workflow table".format(len(task_info_update_messages)))
-                    self._update(table=WORKFLOW,
-                                 columns=['run_id', 'tasks_failed_count',
-                                          'tasks_completed_count'],
-                                 messages=task_info_all_messages)
-
-                    if task_info_insert_messages:
-                        self._insert(table=TASK, messages=task_info_insert_messages)
-                        logger.debug(
-                            "There are {} inserted task records".format(len(inserted_tasks)))
-
-                    if task_info_update_messages:
-                        logger.debug("Updating {} TASK_INFO into task table".format(len(task_info_update_messages)))
-                        self._update(table=TASK,
-                                     columns=['task_time_invoked',
-                                              'task_time_returned',
-                                              'run_id', 'task_id',
-                                              'task_fail_count',
-                                              'task_fail_cost',
-                                              'task_hashsum',
-                                              'task_inputs'],
-                                     messages=task_info_update_messages)
-                    logger.debug("Inserting {} task_info_all_messages into status table".format(len(task_info_all_messages)))
-
-                    self._insert(table=STATUS, messages=task_info_all_messages)
+                    logger.debug("Updating %s TASK_INFO into workflow table", len(task_info_update_messages))
+                    ops.append(('update', WORKFLOW,
+                                ['run_id', 'tasks_failed_count',
+                                 'tasks_completed_count'],
+                                task_info_all_messages))
+
+                    if task_info_all_messages and self.db.supports_upsert:
+                        # A single INSERT ... ON CONFLICT DO UPDATE covers
+                        # both never-before-seen tasks and updates to
+                        # existing rows, halving the statements issued for
+                        # mixed batches.
+                        #
+                        # Keep only the newest message per primary key:
+                        # one batch routinely carries several TASK_INFO
+                        # messages for the same task, and drivers which
+                        # fold an executemany page into one INSERT (such
+                        # as psycopg2's execute_values) would then hit
+                        # PostgreSQL's "ON CONFLICT DO UPDATE command
+                        # cannot affect row a second time" error. Each
+                        # TASK_INFO message carries the full task record,
+                        # so later messages subsume earlier ones.
+                        latest_task_info = {}  # type: Dict[Any, MonitoringMessage]
+                        for msg in task_info_all_messages:
+                            latest_task_info[(msg['task_id'], msg['run_id'])] = msg
+                        task_info_upsert_messages = list(latest_task_info.values())
+                        logger.debug("Upserting %s TASK_INFO into task table", len(task_info_upsert_messages))
+                        ops.append(('upsert', TASK, TASK_UPDATE_COLUMNS, task_info_upsert_messages))
+                    else:
+                        if task_info_insert_messages:
+                            ops.append(('insert', TASK, None, task_info_insert_messages))
+                            logger.debug("There are %s inserted task records", len(inserted_tasks))
+
+                        if task_info_update_messages:
+                            logger.debug("Updating %s TASK_INFO into task table", len(task_info_update_messages))
+                            ops.append(('update', TASK,
+                                        TASK_UPDATE_COLUMNS,
+                                        task_info_update_messages))
+                    logger.debug("Inserting %s task_info_all_messages into status table", len(task_info_all_messages))
+
+                    # This stays a separate statement from the task
+                    # insert/upsert above rather than being folded into it
+                    # with a WITH ... RETURNING CTE: the status columns
+                    # (task_status_name, timestamp, try_id) come from the
+                    # message, not from the task row, so RETURNING could not
+                    # supply them. Both statements already share one
+                    # transaction and round trip per batch via bulk_apply,
+                    # and their ordering here keeps status rows from
+                    # preceding their task rows.
+                    ops.append(('insert', STATUS, None, task_info_all_messages))
 
                     if try_insert_messages:
-                        logger.debug("Inserting {} TASK_INFO to try table".format(len(try_insert_messages)))
-                        self._insert(table=TRY, messages=try_insert_messages)
-                        logger.debug(
-                            "There are {} inserted task records".format(len(inserted_tasks)))
+                        logger.debug("Inserting %s TASK_INFO to try table", len(try_insert_messages))
+                        ops.append(('insert', TRY, None, try_insert_messages))
+                        logger.debug("There are %s inserted task records", len(inserted_tasks))
 
                     if try_update_messages:
-                        logger.debug("Updating {} TASK_INFO into try table".format(len(try_update_messages)))
-                        self._update(table=TRY,
-                                     columns=['run_id', 'task_id', 'try_id',
-                                              'task_fail_history',
-                                              'task_try_time_launched',
-                                              'task_try_time_returned',
-                                              'task_joins'],
-                                     messages=try_update_messages)
+                        logger.debug("Updating %s TASK_INFO into try table", len(try_update_messages))
+                        ops.append(('update', TRY,
+                                    ['run_id', 'task_id', 'try_id',
+                                     'task_fail_history',
+                                     'task_try_time_launched',
+                                     'task_try_time_returned',
+                                     'task_joins'],
+                                    try_update_messages))
 
                 """
                 NODE_INFO messages
 
                 """
-                node_info_messages = self._get_messages_in_batch(self.pending_node_queue)
+                node_batch = self._get_messages_in_batch(node_queue)
+                got_messages = got_messages or node_batch != []
+                node_info_messages = []  # type: List[MonitoringMessage]
+                for x in node_batch:
+                    assert len(x) == 2, "expected message tuple to have exactly two elements"
+                    assert x[0] == MessageType.NODE_INFO, "the node queue can only hold NODE_INFO messages"
+                    node_info_messages.append(x[1])
                 if node_info_messages:
-                    logger.debug(
-                        "Got {} messages from node queue".format(len(node_info_messages)))
-                    self._insert(table=NODE, messages=node_info_messages)
+                    logger.debug("Got %s messages from node queue", len(node_info_messages))
+                    ops.append(('insert', NODE, None, node_info_messages))
 
                 """
                 BLOCK_INFO messages
 
                 """
-                block_info_messages = self._get_messages_in_batch(self.pending_block_queue)
+                block_batch = self._get_messages_in_batch(block_queue)
+                got_messages = got_messages or block_batch != []
+                block_info_messages = []  # type: List[MonitoringMessage]
+                for x in block_batch:
+                    block_info_messages.append(x[-1])
                 if block_info_messages:
-                    logger.debug(
-                        "Got {} messages from block queue".format(len(block_info_messages)))
+                    logger.debug("Got %s messages from block queue", len(block_info_messages))
                     # block_info_messages is possibly a nested list of dict (at different polling times)
                     # Each dict refers to the info of a job/block at one polling time
                     block_messages_to_insert = []  # type: List[Any]
                     for block_msg in block_info_messages:
                         block_messages_to_insert.extend(block_msg)
-                    self._insert(table=BLOCK, messages=block_messages_to_insert)
+                    ops.append(('insert', BLOCK, None, block_messages_to_insert))
 
                 """
                 Resource info messages
 
                 """
-                resource_messages = self._get_messages_in_batch(self.pending_resource_queue)
+                resource_batch = self._get_messages_in_batch(resource_queue)
+                got_messages = got_messages or resource_batch != []
+                resource_messages = []  # type: List[MonitoringMessage]
+                for x in resource_batch:
+                    assert isinstance(x, tuple), "the resource queue is expected to hold tuples, got {}".format(x)
+                    assert x[0] == MessageType.RESOURCE_INFO, \
+                        "the resource queue can only hold RESOURCE_INFO messages, got tag {}, message {}".format(x[0], x)
+                    resource_messages.append(x[1])
 
                 if resource_messages:
-                    logger.debug(
-                        "Got {} messages from resource queue, "
-                        "{} reprocessable as first messages, "
-                        "{} reprocessable as last messages".format(len(resource_messages),
-                                                                   len(reprocessable_first_resource_messages),
-                                                                   len(reprocessable_last_resource_messages)))
+                    logger.debug("Got %s messages from resource queue, "
+                                 "%s reprocessable as first messages, "
+                                 "%s reprocessable as last messages",
+                                 len(resource_messages),
+                                 len(reprocessable_first_resource_messages),
+                                 len(reprocessable_last_resource_messages))
 
                     insert_resource_messages = []
                     for msg in resource_messages:
@@ -540,149 +751,126 @@ class DatabaseManager:
                             insert_resource_messages.append(msg)
 
                     if insert_resource_messages:
-                        self._insert(table=RESOURCE, messages=insert_resource_messages)
+                        ops.append(('insert', RESOURCE, None, insert_resource_messages))
 
                 if reprocessable_first_resource_messages:
-                    self._insert(table=STATUS, messages=reprocessable_first_resource_messages)
-                    self._update(table=TRY,
-                                 columns=['task_try_time_running',
-                                          'run_id', 'task_id', 'try_id',
-                                          'block_id', 'hostname'],
-                                 messages=reprocessable_first_resource_messages)
+                    ops.append(('insert', STATUS, None, reprocessable_first_resource_messages))
+                    ops.append(('update', TRY,
+                                ['task_try_time_running',
+                                 'run_id', 'task_id', 'try_id',
+                                 'block_id', 'hostname'],
+                                reprocessable_first_resource_messages))
 
                 if reprocessable_last_resource_messages:
-                    self._insert(table=STATUS, messages=reprocessable_last_resource_messages)
+                    ops.append(('insert', STATUS, None, reprocessable_last_resource_messages))
+
+                if ops:
+                    self._write_queue.put(ops)
             except Exception:
                 logger.exception(
                     "Exception in db loop: this might have been a malformed message, "
                     "or some other error. monitoring data may have been lost"
                 )
                 exception_happened = True
+
+            if self._kill_event.is_set() and not got_messages:
+                break
+
+        # None is the writer's sentinel to finish: everything queued
+        # before it will have been applied by the time join returns.
+        self._write_queue.put(None)
+        self._writer_thread.join()
+
         if exception_happened:
             raise RuntimeError("An exception happened sometime during database processing and should have been logged in database_manager.log")
 
     @wrap_with_logs(target="database_manager")
-    def _migrate_logs_to_internal(self, logs_queue: queue.Queue, queue_tag: str, kill_event: threading.Event) -> None:
-        logger.info("Starting processing for queue {}".format(queue_tag))
-
-        while not kill_event.is_set() or logs_queue.qsize() != 0:
-            logger.debug("""Checking STOP conditions for {} threads: {}, {}"""
-                         .format(queue_tag, kill_event.is_set(), logs_queue.qsize() != 0))
-            try:
-                x, addr = logs_queue.get(timeout=0.1)
-            except queue.Empty:
-                continue
-            else:
-                if queue_tag == 'priority' and x == 'STOP':
-                    self.close()
-                elif queue_tag == 'priority':  # implicitly not 'STOP'
-                    assert isinstance(x, tuple)
-                    assert len(x) == 2
-                    assert x[0] in [MessageType.WORKFLOW_INFO, MessageType.TASK_INFO], \
-                        "_migrate_logs_to_internal can only migrate WORKFLOW_,TASK_INFO message from priority queue, got x[0] == {}".format(x[0])
-                    self._dispatch_to_internal(x)
-                elif queue_tag == 'resource':
-                    assert isinstance(x, tuple), "_migrate_logs_to_internal was expecting a tuple, got {}".format(x)
-                    assert x[0] == MessageType.RESOURCE_INFO, \
-                        "_migrate_logs_to_internal can only migrate RESOURCE_INFO message from resource queue, got tag {}, message {}".format(x[0], x)
-                    self._dispatch_to_internal(x)
-                elif queue_tag == 'node':
-                    assert len(x) == 2, "expected message tuple to have exactly two elements"
-                    assert x[0] == MessageType.NODE_INFO, "_migrate_logs_to_internal can only migrate NODE_INFO messages from node queue"
-
-                    self._dispatch_to_internal(x)
-                elif queue_tag == "block":
-                    self._dispatch_to_internal(x)
-                else:
-                    logger.error(f"Discarding because unknown queue tag '{queue_tag}', message: {x}")
-
-    def _dispatch_to_internal(self, x: Tuple) -> None:
-        if x[0] in [MessageType.WORKFLOW_INFO, MessageType.TASK_INFO]:
-            self.pending_priority_queue.put(cast(Any, x))
-        elif x[0] == MessageType.RESOURCE_INFO:
-            body = x[1]
-            self.pending_resource_queue.put(body)
-        elif x[0] == MessageType.NODE_INFO:
-            assert len(x) == 2, "expected NODE_INFO tuple to have exactly two elements"
-
-            logger.info("Will put {} to pending node queue".format(x[1]))
-            self.pending_node_queue.put(x[1])
-        elif x[0] == MessageType.BLOCK_INFO:
-            logger.info("Will put {} to pending block queue".format(x[1]))
-            self.pending_block_queue.put(x[-1])
+    def _writer(self) -> None:
+        logger.info("Starting database writer thread")
+        while True:
+            batch = self._write_queue.get()
+            if batch is None:
+                break
+            t0 = time.monotonic()
+            self._apply(batch)
+            self._adjust_batching(time.monotonic() - t0,
+                                  sum(len(messages) for _op, _table, _columns, messages in batch))
+        logger.info("Database writer thread finishing")
+
+    def _adjust_batching(self, commit_time: float, n_messages: int) -> None:
+        """Adapt the batching threshold to observed commit latency.
+
+        If a batch that filled the threshold committed in well under a
+        batching interval there is headroom for larger batches; if a
+        commit took longer than two intervals, batches are outpacing the
+        database and should shrink so memory does not build up behind it.
+        """
+        threshold = self.batching_threshold
+        interval = self.batching_interval
+        if threshold == float('inf') or interval == float('inf'):
+            # close() pins these to infinity to drain the queues at
+            # shutdown - leave them alone.
+            return
+
+        if commit_time > 2 * interval:
+            new_threshold = max(threshold // 2, MIN_BATCHING_THRESHOLD)
+        elif commit_time < 0.1 * interval and n_messages >= threshold:
+            new_threshold = min(threshold * 2, MAX_BATCHING_THRESHOLD)
         else:
-            logger.error("Discarding message of unknown type {}".format(x[0]))
+            return
+
+        if new_threshold != threshold:
+            self.batching_threshold = new_threshold
+            logger.info("Adjusted batching threshold to %s (last commit of %s messages took %.3fs)",
+                        new_threshold, n_messages, commit_time)
 
-    def _update(self, table: str, columns: List[str], messages: List[MonitoringMessage]) -> None:
+    def _apply(self, ops: List[DBOp]) -> None:
         try:
             done = False
             while not done:
                 try:
-                    self.db.update(table=table, columns=columns, messages=messages)
+                    self.db.bulk_apply(ops)
                     done = True
                 except sa.exc.OperationalError as e:
                     # This code assumes that an OperationalError is something that will go away eventually
                     # if retried - for example, the database being locked because someone else is readying
                     # the tables we are trying to write to. If that assumption is wrong, then this loop
-                    # may go on forever.
+                    # may go on forever. Because bulk_apply runs all of the
+                    # operations in one engine.begin() transaction, a failed
+                    # attempt has already been rolled back in its entirety
+                    # when the exception reaches here, so a retry starts
+                    # from a clean state.
                     logger.warning("Got a database OperationalError. Ignoring and retrying on the assumption that it is recoverable: {}".format(e))
-                    self.db.rollback()
                     time.sleep(1)  # hard coded 1s wait - this should be configurable or exponential backoff or something
 
         except KeyboardInterrupt:
-            logger.exception("KeyboardInterrupt when trying to update Table {}".format(table))
-            try:
-                self.db.rollback()
-            except Exception:
-                logger.exception("Rollback failed")
-            raise
-        except Exception:
-            logger.exception("Got exception when trying to update table {}".format(table))
-            try:
-                self.db.rollback()
-            except Exception:
-                logger.exception("Rollback failed")
-
-    def _insert(self, table: str, messages: List[MonitoringMessage]) -> None:
-        try:
-            done = False
-            while not done:
-                try:
-                    self.db.insert(table=table, messages=messages)
-                    done = True
-                except sa.exc.OperationalError as e:
-                    # hoping that this is a database locked error during _update, not some other problem
-                    logger.warning("Got a database OperationalError. Ignoring and retrying on the assumption that it is recoverable: {}".format(e))
-                    self.db.rollback()
-                    time.sleep(1)  # hard coded 1s wait - this should be configurable or exponential backoff or something
-        except KeyboardInterrupt:
-            logger.exception("KeyboardInterrupt when trying to update Table {}".format(table))
-            try:
-                self.db.rollback()
-            except Exception:
-                logger.exception("Rollback failed")
+            logger.exception("KeyboardInterrupt when trying to apply {} operations to the database".format(len(ops)))
             raise
         except Exception:
-            logger.exception("Got exception when trying to insert to table {}".format(table))
-            try:
-                self.db.rollback()
-            except Exception:
-                logger.exception("Rollback failed")
+            logger.exception("Got exception when trying to apply {} operations to the database".format(len(ops)))
 
     def _get_messages_in_batch(self, msg_queue: "queue.Queue[X]") -> List[X]:
         messages = []  # type: List[X]
         start = time.time()
-        while True:
-            if time.time() - start >= self.batching_interval or len(messages) >= self.batching_threshold:
-                break
+
+        # Make one blocking wait for the first message of a batch, then
+        # drain whatever else has already arrived with non-blocking gets.
+        # An idle queue then costs a single timed wait per batching
+        # interval, rather than a stream of short get/Empty cycles.
+        # close() sets batching_interval to infinity to drain the queues
+        # at shutdown, so the initial wait is bounded to keep that
+        # responsive.
+        try:
+            messages.append(msg_queue.get(timeout=min(self.batching_interval, 1.0)))
+        except queue.Empty:
+            logger.debug("Database manager has not received any message.")
+            return messages
+
+        while time.time() - start < self.batching_interval and len(messages) < self.batching_threshold:
             try:
-                x = msg_queue.get(timeout=0.1)
-                # logger.debug("Database manager receives a message {}".format(x))
+                messages.append(msg_queue.get_nowait())
             except queue.Empty:
-                logger.debug("Database manager has not received any message.")
                 break
-            else:
-                messages.append(x)
         return messages
 
     def close(self) -> None:
@@ -693,10 +881,10 @@ class DatabaseManager:
             msg = {'time_completed': time_completed,
                    'workflow_duration': (time_completed - self.workflow_start_message['time_began']).total_seconds()}
             self.workflow_start_message.update(msg)
-            self._update(table=WORKFLOW,
-                         columns=['run_id', 'time_completed',
-                                  'workflow_duration'],
-                         messages=[self.workflow_start_message])
+            self._apply([('update', WORKFLOW,
+                          ['run_id', 'time_completed',
+                           'workflow_duration'],
+                          [self.workflow_start_message])])
         self.batching_interval = float('inf')
         self.batching_threshold = float('inf')
         self._kill_event.set()
@@ -704,10 +892,10 @@ class DatabaseManager:
 
 @wrap_with_logs(target="database_manager")
 def dbm_starter(exception_q: "queue.Queue[Tuple[str, str]]",
-                priority_msgs: "queue.Queue[TaggedMonitoringMessage]",
-                node_msgs: "queue.Queue[MonitoringMessage]",
-                block_msgs: "queue.Queue[MonitoringMessage]",
-                resource_msgs: "queue.Queue[MonitoringMessage]",
+                priority_msgs: "queue.Queue[Union[TaggedMonitoringMessage, str]]",
+                node_msgs: "queue.Queue[TaggedMonitoringMessage]",
+                block_msgs: "queue.Queue[TaggedMonitoringMessage]",
+                resource_msgs: "queue.Queue[TaggedMonitoringMessage]",
                 db_url: str,
                 logdir: str,
                 logging_level: int) -> None:
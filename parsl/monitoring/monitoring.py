@@ -22,7 +22,7 @@ from parsl.utils import setproctitle
 from parsl.serialize import deserialize
 
 from parsl.monitoring.message_type import MessageType
-from parsl.monitoring.types import AddressedMonitoringMessage, TaggedMonitoringMessage
+from parsl.monitoring.types import TaggedMonitoringMessage
 from typing import cast, Any, Callable, Dict, Optional, Sequence, Tuple, Union, TYPE_CHECKING
 
 _db_manager_excepts: Optional[Exception]
@@ -195,16 +195,16 @@ class MonitoringHub(RepresentationMixin):
         self.exception_q: Queue[Tuple[str, str]]
         self.exception_q = SizedQueue(maxsize=10)
 
-        self.priority_msgs: Queue[Tuple[Any, int]]
+        self.priority_msgs: Queue[Union[TaggedMonitoringMessage, str]]
         self.priority_msgs = SizedQueue()
 
-        self.resource_msgs: Queue[AddressedMonitoringMessage]
+        self.resource_msgs: Queue[TaggedMonitoringMessage]
         self.resource_msgs = SizedQueue()
 
-        self.node_msgs: Queue[AddressedMonitoringMessage]
+        self.node_msgs: Queue[TaggedMonitoringMessage]
         self.node_msgs = SizedQueue()
 
-        self.block_msgs: Queue[AddressedMonitoringMessage]
+        self.block_msgs: Queue[TaggedMonitoringMessage]
         self.block_msgs = SizedQueue()
 
         self.router_proc = ForkProcess(target=router_starter,
@@ -304,7 +304,7 @@ class MonitoringHub(RepresentationMixin):
             self.logger.debug("Finished waiting for router termination")
             if len(exception_msgs) == 0:
                 self.logger.debug("Sending STOP to DBM")
-                self.priority_msgs.put(("STOP", 0))
+                self.priority_msgs.put("STOP")
             else:
                 self.logger.debug("Not sending STOP to DBM, because there were DBM exceptions")
             self.logger.debug("Waiting for DB termination")
@@ -336,7 +336,7 @@ class MonitoringHub(RepresentationMixin):
 
 
 @wrap_with_logs
-def filesystem_receiver(logdir: str, q: "queue.Queue[AddressedMonitoringMessage]", run_dir: str) -> None:
+def filesystem_receiver(logdir: str, q: "queue.Queue[TaggedMonitoringMessage]", run_dir: str) -> None:
     logger = start_file_logger("{}/monitoring_filesystem_radio.log".format(logdir),
                                name="monitoring_filesystem_radio",
                                level=logging.INFO)
@@ -363,7 +363,7 @@ def filesystem_receiver(logdir: str, q: "queue.Queue[AddressedMonitoringMessage]
                     message = deserialize(f.read())
                 logger.debug(f"Message received is: {message}")
                 assert isinstance(message, tuple)
-                q.put(cast(AddressedMonitoringMessage, message))
+                q.put(cast(TaggedMonitoringMessage, message))
                 os.remove(full_path_filename)
             except Exception:
                 logger.exception(f"Exception processing {filename} - probably will be retried next iteration")
@@ -445,10 +445,10 @@ class MonitoringRouter:
                                                            max_port=hub_port_range[1])
 
     def start(self,
-              priority_msgs: "queue.Queue[AddressedMonitoringMessage]",
-              node_msgs: "queue.Queue[AddressedMonitoringMessage]",
-              block_msgs: "queue.Queue[AddressedMonitoringMessage]",
-              resource_msgs: "queue.Queue[AddressedMonitoringMessage]") -> None:
+              priority_msgs: "queue.Queue[TaggedMonitoringMessage]",
+              node_msgs: "queue.Queue[TaggedMonitoringMessage]",
+              block_msgs: "queue.Queue[TaggedMonitoringMessage]",
+              resource_msgs: "queue.Queue[TaggedMonitoringMessage]") -> None:
         try:
             router_keep_going = True
             while router_keep_going:
@@ -456,7 +456,7 @@ class MonitoringRouter:
                     data, addr = self.sock.recvfrom(2048)
                     resource_msg = pickle.loads(data)
                     self.logger.debug("Got UDP Message from {}: {}".format(addr, resource_msg))
-                    resource_msgs.put((resource_msg, addr))
+                    resource_msgs.put(resource_msg)
                 except socket.timeout:
                     pass
 
@@ -471,20 +471,17 @@ class MonitoringRouter:
                         assert len(msg) >= 1, "IC Channel expects tuples of length at least 1, got {}".format(msg)
                         assert len(msg) == 2, "IC Channel expects message tuples of exactly length 2, got {}".format(msg)
 
-                        msg_0: AddressedMonitoringMessage
-                        msg_0 = (msg, 0)
-
                         if msg[0] == MessageType.NODE_INFO:
                             msg[1]['run_id'] = self.run_id
-                            node_msgs.put(msg_0)
+                            node_msgs.put(msg)
                         elif msg[0] == MessageType.RESOURCE_INFO:
-                            resource_msgs.put(msg_0)
+                            resource_msgs.put(msg)
                         elif msg[0] == MessageType.BLOCK_INFO:
-                            block_msgs.put(msg_0)
+                            block_msgs.put(msg)
                         elif msg[0] == MessageType.TASK_INFO:
-                            priority_msgs.put(msg_0)
+                            priority_msgs.put(msg)
                         elif msg[0] == MessageType.WORKFLOW_INFO:
-                            priority_msgs.put(msg_0)
+                            priority_msgs.put(msg)
                             if 'exit_now' in msg[1] and msg[1]['exit_now']:
                                 router_keep_going = False
                         else:
@@ -510,7 +507,7 @@ class MonitoringRouter:
                     data, addr = self.sock.recvfrom(2048)
                     msg = pickle.loads(data)
                     self.logger.debug("Got UDP Message from {}: {}".format(addr, msg))
-                    resource_msgs.put((msg, addr))
+                    resource_msgs.put(msg)
                     last_msg_received_time = time.time()
                 except socket.timeout:
                     pass
@@ -523,10 +520,10 @@ class MonitoringRouter:
 @wrap_with_logs
 def router_starter(comm_q: "queue.Queue[Union[Tuple[int, int], str]]",
                    exception_q: "queue.Queue[Tuple[str, str]]",
-                   priority_msgs: "queue.Queue[AddressedMonitoringMessage]",
-                   node_msgs: "queue.Queue[AddressedMonitoringMessage]",
-                   block_msgs: "queue.Queue[AddressedMonitoringMessage]",
-                   resource_msgs: "queue.Queue[AddressedMonitoringMessage]",
+                   priority_msgs: "queue.Queue[TaggedMonitoringMessage]",
+                   node_msgs: "queue.Queue[TaggedMonitoringMessage]",
+                   block_msgs: "queue.Queue[TaggedMonitoringMessage]",
+                   resource_msgs: "queue.Queue[TaggedMonitoringMessage]",
 
                    hub_address: str,
                    hub_port: Optional[int],
@@ -0,0 +1,121 @@
+"""Unit tests for the monitoring database manager, driving the
+Database and DatabaseManager classes directly rather than through a
+full parsl workflow run.
+"""
+
+import datetime
+import logging
+import queue
+import uuid
+
+import pytest
+
+from parsl.monitoring.message_type import MessageType
+
+logger = logging.getLogger(__name__)
+
+
+def workflow_start_message(run_id):
+    return {'run_id': run_id,
+            'python_version': '0.0.0',
+            'time_began': datetime.datetime.now(),
+            'host': 'testhost',
+            'user': 'testuser',
+            'rundir': 'runinfo/000',
+            'tasks_failed_count': 0,
+            'tasks_completed_count': 0}
+
+
+def task_info_message(run_id, task_id, try_id, returned=False):
+    # a subset of what the DFK sends in a real TASK_INFO message: the
+    # non-nullable columns of the task, try and status tables, plus the
+    # columns the manager uses to update the workflow row.
+    now = datetime.datetime.now()
+    return {'run_id': run_id,
+            'task_id': task_id,
+            'try_id': try_id,
+            'task_func_name': 'test_func',
+            'task_memoize': 'False',
+            'task_fail_count': 0,
+            'task_fail_cost': 0,
+            'task_executor': 'test_executor',
+            'task_time_invoked': now,
+            'task_time_returned': now if returned else None,
+            'task_status_name': 'exec_done' if returned else 'pending',
+            'timestamp': now,
+            'tasks_failed_count': 0,
+            'tasks_completed_count': 1 if returned else 0}
+
+
+def scalar(connection, sql):
+    from sqlalchemy import text
+    (v, ) = connection.execute(text(sql)).first()
+    return v
+
+
+@pytest.mark.local
+def test_database_bulk_apply(tmpd_cwd):
+    from parsl.monitoring.db_manager import TASK, TASK_UPDATE_COLUMNS, WORKFLOW, Database
+
+    db = Database("sqlite:///{}".format(tmpd_cwd / "monitoring.db"))
+    run_id = str(uuid.uuid4())
+
+    db.bulk_apply([('insert', WORKFLOW, None, [workflow_start_message(run_id)])])
+
+    # this update passes workflow_duration, which is not a column of the
+    # workflow table, as close() does on abnormal exit - it must be
+    # ignored rather than failing the statement.
+    end = datetime.datetime.now()
+    db.bulk_apply([('update', WORKFLOW,
+                    ['run_id', 'time_completed', 'workflow_duration'],
+                    [{'run_id': run_id,
+                      'time_completed': end,
+                      'workflow_duration': 1.0}])])
+
+    # an upsert batch containing the same primary key twice must leave
+    # one row holding the values of the later message.
+    assert db.supports_upsert
+    db.bulk_apply([('upsert', TASK, TASK_UPDATE_COLUMNS,
+                    [task_info_message(run_id, 0, 0)])])
+    db.bulk_apply([('upsert', TASK, TASK_UPDATE_COLUMNS,
+                    [task_info_message(run_id, 0, 0, returned=True)])])
+
+    with db.eng.begin() as connection:
+        assert scalar(connection, "SELECT COUNT(*) FROM workflow") == 1
+        assert scalar(connection, "SELECT time_completed FROM workflow") is not None
+        assert scalar(connection, "SELECT COUNT(*) FROM task") == 1
+        assert scalar(connection, "SELECT task_time_returned FROM task") is not None
+
+
+@pytest.mark.local
+def test_database_manager_stop(tmpd_cwd):
+    import sqlalchemy
+    from parsl.monitoring.db_manager import DatabaseManager
+
+    db_url = "sqlite:///{}".format(tmpd_cwd / "monitoring.db")
+    dbm = DatabaseManager(db_url=db_url,
+                          logdir=str(tmpd_cwd),
+                          batching_interval=0.1)
+
+    priority_queue = queue.Queue()  # type: queue.Queue
+    node_queue = queue.Queue()  # type: queue.Queue
+    block_queue = queue.Queue()  # type: queue.Queue
+    resource_queue = queue.Queue()  # type: queue.Queue
+
+    run_id = str(uuid.uuid4())
+    priority_queue.put((MessageType.WORKFLOW_INFO, workflow_start_message(run_id)))
+    priority_queue.put((MessageType.TASK_INFO, task_info_message(run_id, 0, 0)))
+    priority_queue.put((MessageType.TASK_INFO, task_info_message(run_id, 0, 0, returned=True)))
+    priority_queue.put("STOP")
+
+    # start() returns once the STOP sentinel has been seen and the
+    # queues have drained, with the writer thread joined.
+    dbm.start(priority_queue, node_queue, block_queue, resource_queue)
+
+    engine = sqlalchemy.create_engine(db_url)
+    with engine.begin() as connection:
+        assert scalar(connection, "SELECT COUNT(*) FROM workflow") == 1
+        assert scalar(connection, "SELECT COUNT(*) FROM task") == 1
+        assert scalar(connection, "SELECT task_time_returned FROM task") is not None
+        assert scalar(connection, "SELECT COUNT(*) FROM try") == 1
+        assert scalar(connection, "SELECT COUNT(*) FROM status") == 2